@@ -4,128 +4,336 @@ Professional Network Device Configuration Backup Script
 Features: Multi-device support, logging, timestamped backups, email notifications
 """
 
-import yaml
 from netmiko import ConnectHandler
 from datetime import datetime
 import os
+import sys
 import logging
+from logging.handlers import QueueHandler, QueueListener
 import argparse
+import atexit
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from inventory import load_inventory
 
 # Import email module if available
 try:
-    from email_notification import send_email_report, load_email_config
+    from email_notification import (
+        queue_report, flush_reports, load_email_config, email_config_complete
+    )
     EMAIL_AVAILABLE = True
 except ImportError:
     EMAIL_AVAILABLE = False
 
+# Import zstandard if available (used for --compress)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Serialize console output so lines from worker threads don't interleave
+_print_lock = threading.Lock()
+
+def console(message):
+    """Thread-safe print for progress messages"""
+    # One write per message, so the line and its newline can't be split
+    with _print_lock:
+        sys.stdout.write(message + "\n")
+        sys.stdout.flush()
+
+class _ConsoleHandler(logging.StreamHandler):
+    """StreamHandler that shares console()'s lock, keeping log and progress lines whole"""
+    def emit(self, record):
+        with _print_lock:
+            super().emit(record)
+
 # Set up logging
 log_dir = "logs"
 os.makedirs(log_dir, exist_ok=True)
 
-log_file = f"{log_dir}/backup_{datetime.now().strftime('%Y-%m-%d')}.log"
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
+def _log_file_path():
+    """Path of today's log file"""
+    return f"{log_dir}/backup_{datetime.now().strftime('%Y-%m-%d')}.log"
+
+log_file = _log_file_path()
+
+# Worker threads only enqueue records; a single listener thread formats them
+# and writes to the file and console handlers
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+file_handler = logging.FileHandler(log_file)
+console_handler = _ConsoleHandler()
+for handler in (file_handler, console_handler):
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(log_queue, file_handler, console_handler)
+
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(QueueHandler(log_queue))
+log_listener.start()
+atexit.register(log_listener.stop)
+
+def rotate_log_file():
+    """Switch the file handler to today's log; long-lived processes call this per run"""
+    global log_file, file_handler
+    path = _log_file_path()
+    if path == log_file:
+        return
+    
+    new_handler = logging.FileHandler(path)
+    new_handler.setFormatter(log_formatter)
+    
+    # Stopping the listener drains queued records into the old file first
+    log_listener.stop()
+    old_handler = file_handler
+    file_handler, log_file = new_handler, path
+    log_listener.handlers = (file_handler, console_handler)
+    log_listener.start()
+    old_handler.close()
+
+# Header written at the top of every backup file
+BACKUP_HEADER = (
+    "! Backup Date: {date}\n"
+    "! Device: {name}\n"
+    "! Host: {host}\n"
+    + "!"*60 + "\n\n"
 )
 
+# Open SSH sessions keyed per inventory entry, reused across runs in one process
+_CONN_CACHE = {}
+
 def load_devices(inventory_file):
-    """Load device inventory from YAML file"""
+    """Load device inventory from YAML file; returns (devices, invalid device names)"""
     try:
-        with open(inventory_file, 'r') as file:
-            data = yaml.safe_load(file)
-            return data['devices']
+        devices, invalid = load_inventory(inventory_file)
     except FileNotFoundError:
-        logging.error(f"Inventory file {inventory_file} not found!")
-        return []
+        logging.error("Inventory file %s not found!", inventory_file)
+        return [], []
     except Exception as e:
-        logging.error(f"Failed to load inventory: {e}")
-        return []
+        logging.error("Failed to load inventory: %s", e)
+        return [], []
+    
+    for name, error in invalid:
+        console(f"✗ Skipping invalid inventory entry {name}: {error}")
+        logging.error("Skipping invalid inventory entry %s: %s", name, error)
+    return devices, [name for name, _ in invalid]
+
+def _connection_key(device):
+    """Cache key for a device's session; entries sharing a host still get their own"""
+    return (device.host, device.port, device.device_type, device.username, device.name)
+
+def get_connection(device):
+    """Return (connection, reused) for a device, reusing a cached session if possible"""
+    key = _connection_key(device)
+    connection = _CONN_CACHE.get(key)
+    if connection is not None and connection.is_alive():
+        return connection, True
+    connection = ConnectHandler(**device.connection_params())
+    _CONN_CACHE[key] = connection
+    return connection, False
+
+def drop_connection(device):
+    """Remove a device's cached session, e.g. after it failed mid-backup"""
+    connection = _CONN_CACHE.pop(_connection_key(device), None)
+    if connection is not None:
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
+
+def prune_connections(devices):
+    """Close cached sessions for devices that are no longer in the inventory"""
+    current = {_connection_key(device) for device in devices}
+    for key in [key for key in _CONN_CACHE if key not in current]:
+        connection = _CONN_CACHE.pop(key)
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
 
-def backup_device(device, output_dir="backups"):
+def close_connections():
+    """Disconnect every cached session"""
+    for connection in list(_CONN_CACHE.values()):
+        try:
+            connection.disconnect()
+        except Exception:
+            pass
+    _CONN_CACHE.clear()
+
+def _read_hash_index(index_file):
+    """Return (digest, backup file) recorded for a device's last stored config"""
+    try:
+        with open(index_file, 'r') as f:
+            digest, path = f.read().rstrip('\n').split(' ', 1)
+            return digest, path
+    except (OSError, ValueError):
+        return None, None
+
+def _write_hash_index(index_file, digest, path):
+    """Record the digest and location of a device's latest stored config"""
+    with open(index_file, 'w') as f:
+        f.write(f"{digest} {path}\n")
+
+def prepare_backup_dirs(output_dir="backups"):
+    """Create today's backup directory and the hash index directory once per run"""
+    backup_dir = f"{output_dir}/{datetime.now().strftime('%Y-%m-%d')}"
+    index_dir = f"{output_dir}/.index"
+    os.makedirs(backup_dir, exist_ok=True)
+    os.makedirs(index_dir, exist_ok=True)
+    return backup_dir, index_dir
+
+def backup_device(device, backup_dir, index_dir, compress=False):
     """Connect to device and backup configuration"""
-    device_name = device.pop('device_name', device['host'])
+    device_name = device.name
     
     try:
-        logging.info(f"Connecting to {device_name}...")
-        print(f"\n[{datetime.now().strftime('%H:%M:%S')}] Connecting to {device_name}...")
-        
-        # Connect to device
-        connection = ConnectHandler(**device)
+        logging.info("Connecting to %s...", device_name)
+        console(f"\n[{datetime.now().strftime('%H:%M:%S')}] Connecting to {device_name}...")
         
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Connected! Retrieving configuration...")
-        logging.info(f"Successfully connected to {device_name}")
+        # Connect to device (or reuse the session from a previous run)
+        connection, reused = get_connection(device)
         
-        # Get running configuration
-        config = connection.send_command('show running-config')
+        console(f"[{datetime.now().strftime('%H:%M:%S')}] Connected! Retrieving configuration...")
+        logging.info("Successfully connected to %s", device_name)
         
-        # Get additional info for documentation
-        hostname = connection.send_command('show version | include hostname')
+        # Get running configuration (it already carries the hostname line)
+        try:
+            config = connection.send_command('show running-config')
+        except Exception as e:
+            if not reused:
+                raise
+            # is_alive() can't see a session silently dropped by a firewall/NAT
+            # while idle; reconnect once before counting the device as failed
+            logging.warning("Cached session to %s failed (%s); reconnecting", device_name, e)
+            drop_connection(device)
+            connection, _ = get_connection(device)
+            config = connection.send_command('show running-config')
         
-        # Create backup directory structure
-        today = datetime.now().strftime('%Y-%m-%d')
-        backup_dir = f"{output_dir}/{today}"
-        os.makedirs(backup_dir, exist_ok=True)
+        # Timestamp the backup once so filename and header agree
+        now = datetime.now()
         
         # Create filename with timestamp
-        timestamp = datetime.now().strftime('%H-%M-%S')
-        filename = f"{backup_dir}/{device_name}_{timestamp}.txt"
+        timestamp = now.strftime('%H-%M-%S')
+        base_name = f"{backup_dir}/{device_name}_{timestamp}"
         
-        # Save configuration with header
-        with open(filename, 'w') as backup_file:
-            backup_file.write(f"! Backup Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            backup_file.write(f"! Device: {device_name}\n")
-            backup_file.write(f"! Host: {device.get('host', 'N/A')}\n")
-            backup_file.write("!"*60 + "\n\n")
-            backup_file.write(config)
+        # Identical configs are stored once; later runs skip the write and leave
+        # only a tiny pointer to that copy
+        config_bytes = config.encode()
+        digest = hashlib.blake2b(config_bytes).hexdigest()
+        index_file = f"{index_dir}/{device_name}.hash"
+        previous_digest, previous_file = _read_hash_index(index_file)
         
-        file_size = os.path.getsize(filename) / 1024  # Size in KB
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Backup saved: {filename} ({file_size:.1f} KB)")
-        logging.info(f"Backup successful for {device_name}: {filename} ({file_size:.1f} KB)")
-        
-        # Disconnect
-        connection.disconnect()
+        if digest == previous_digest and os.path.exists(previous_file):
+            filename = f"{base_name}.ptr"
+            with open(filename, 'w') as pointer_file:
+                pointer_file.write(os.path.relpath(previous_file, backup_dir) + "\n")
+            # Index mtime records when the stored config was last confirmed current
+            os.utime(index_file)
+            changed = False
+            console(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Configuration unchanged: {filename} -> {previous_file}")
+            logging.info("Configuration unchanged for %s: %s -> %s", device_name, filename, previous_file)
+        else:
+            # Save configuration with header. The header and config are written
+            # back to back rather than joined, so a multi-MB config is never
+            # copied into a second string before it reaches the file.
+            header = BACKUP_HEADER.format(
+                date=now.strftime('%Y-%m-%d %H:%M:%S'),
+                name=device_name,
+                host=device.host
+            )
+            if compress:
+                filename = f"{base_name}.txt.zst"
+                with open(filename, 'wb') as backup_file:
+                    compressor = zstandard.ZstdCompressor(level=3)
+                    with compressor.stream_writer(backup_file, closefd=False) as writer:
+                        writer.write(header.encode())
+                        writer.write(config_bytes)
+                    file_size = backup_file.tell() / 1024  # Size in KB
+            else:
+                filename = f"{base_name}.txt"
+                with open(filename, 'w', buffering=1024*1024) as backup_file:
+                    backup_file.writelines((header, config))
+                    file_size = backup_file.tell() / 1024  # Size in KB
+            _write_hash_index(index_file, digest, filename)
+            changed = True
+            
+            console(f"[{datetime.now().strftime('%H:%M:%S')}] ✓ Backup saved: {filename} ({file_size:.1f} KB)")
+            logging.info("Backup successful for %s: %s (%.1f KB)", device_name, filename, file_size)
         
-        return True, device_name
+        # Session stays open in _CONN_CACHE for the next scheduled run
+        return True, device_name, changed
         
     except Exception as e:
-        error_msg = f"Failed to backup {device_name}: {str(e)}"
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ {error_msg}")
-        logging.error(error_msg)
-        return False, device_name
+        drop_connection(device)
+        console(f"[{datetime.now().strftime('%H:%M:%S')}] ✗ Failed to backup {device_name}: {e}")
+        logging.error("Failed to backup %s: %s", device_name, e)
+        return False, device_name, False
 
-def generate_report(success_count, fail_count, failed_devices, duration):
+def generate_report(success_count, fail_count, failed_devices, duration, backup_dir, unchanged_count=0):
     """Generate and display summary report"""
-    print("\n" + "="*80)
-    print("BACKUP SUMMARY REPORT")
-    print("="*80)
-    print(f"Execution Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"Duration: {duration:.2f} seconds")
-    print(f"\nResults:")
-    print(f"  ✓ Successful: {success_count}")
-    print(f"  ✗ Failed: {fail_count}")
+    now = datetime.now()
+    lines = [
+        "",
+        "="*80,
+        "BACKUP SUMMARY REPORT",
+        "="*80,
+        f"Execution Time: {now.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"Duration: {duration:.2f} seconds",
+        "",
+        "Results:",
+        f"  ✓ Successful: {success_count}",
+    ]
+    if unchanged_count:
+        lines.append(f"    (unchanged since last backup: {unchanged_count})")
+    lines.append(f"  ✗ Failed: {fail_count}")
     
     if failed_devices:
-        print(f"\nFailed Devices:")
-        for device in failed_devices:
-            print(f"  - {device}")
+        lines.append("")
+        lines.append("Failed Devices:")
+        lines.extend(f"  - {device}" for device in failed_devices)
     
-    print("="*80)
-    print(f"\nLog file: {log_file}")
-    print(f"Backup location: backups/{datetime.now().strftime('%Y-%m-%d')}/")
-    print("="*80)
+    lines.extend([
+        "="*80,
+        "",
+        f"Log file: {log_file}",
+        f"Backup location: {backup_dir}/",
+        "="*80,
+    ])
+    
+    # Emit the whole report in one write
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
 
-def main():
-    """Main function to orchestrate backups"""
+def parse_args(argv=None):
+    """Parse command-line options"""
     parser = argparse.ArgumentParser(description='Network Configuration Backup Script')
     parser.add_argument('--inventory', default='device_inventory.yaml', 
                        help='Device inventory file (default: device_inventory.yaml)')
     parser.add_argument('--no-email', action='store_true',
                        help='Disable email notifications')
-    args = parser.parse_args()
+    parser.add_argument('--email-immediate', action='store_true',
+                       help='Send the email report now instead of batching it')
+    parser.add_argument('--workers', type=int, default=10,
+                       help='Number of devices to back up in parallel (default: 10)')
+    parser.add_argument('--compress', action='store_true',
+                       help='Store backups zstd-compressed (requires zstandard)')
+    return parser.parse_args(argv)
+
+def main(args=None):
+    """Main function to orchestrate backups"""
+    if args is None:
+        args = parse_args()
+    
+    # The scheduler imports this module once, so pick up a new day's log here
+    rotate_log_file()
+    
+    if args.compress and not ZSTD_AVAILABLE:
+        logging.warning("zstandard is not installed - storing uncompressed backups")
+        args.compress = False
     
     start_time = datetime.now()
     
@@ -135,43 +343,65 @@ def main():
     print(f"Start Time: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
     # Load devices from inventory
-    devices = load_devices(args.inventory)
+    devices, invalid_devices = load_devices(args.inventory)
+    
+    # Don't keep sessions open to devices removed from the inventory
+    prune_connections(devices)
     
-    if not devices:
+    if not devices and not invalid_devices:
         print("\n✗ No devices found in inventory!")
         logging.error("No devices in inventory")
         return
     
     print(f"\nFound {len(devices)} device(s) in inventory")
-    logging.info(f"Starting backup for {len(devices)} device(s)")
+    logging.info("Starting backup for %d device(s)", len(devices))
     
-    # Backup each device
+    # Backup each device into a directory created once for the whole run
+    backup_dir, index_dir = prepare_backup_dirs()
     success_count = 0
-    fail_count = 0
-    failed_devices = []
+    unchanged_count = 0
     
-    for device in devices:
-        success, device_name = backup_device(device)
-        if success:
-            success_count += 1
-        else:
-            fail_count += 1
-            failed_devices.append(device_name)
+    # Entries that failed validation count as failed backups
+    fail_count = len(invalid_devices)
+    failed_devices = list(invalid_devices)
+    
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [
+            executor.submit(backup_device, device, backup_dir, index_dir, compress=args.compress)
+            for device in devices
+        ]
+        for future in as_completed(futures):
+            success, device_name, changed = future.result()
+            if success:
+                success_count += 1
+                if not changed:
+                    unchanged_count += 1
+            else:
+                fail_count += 1
+                failed_devices.append(device_name)
     
     # Calculate duration
     end_time = datetime.now()
     duration = (end_time - start_time).total_seconds()
     
     # Generate report
-    generate_report(success_count, fail_count, failed_devices, duration)
+    generate_report(success_count, fail_count, failed_devices, duration, backup_dir, unchanged_count)
     
     # Send email notification if configured
     if EMAIL_AVAILABLE and not args.no_email:
         email_config = load_email_config()
-        if email_config:
-            send_email_report(success_count, fail_count, failed_devices, email_config)
+        if email_config and not email_config_complete(email_config):
+            # Don't queue reports that could never be sent
+            print("\nIncomplete email configuration. Skipping notification.")
+        elif email_config:
+            queue_report(success_count, fail_count, failed_devices, started_at=start_time)
+            flush_reports(email_config, force=args.email_immediate, started_at=start_time)
     
-    logging.info(f"Backup run completed in {duration:.2f}s - Success: {success_count}, Failed: {fail_count}")
+    logging.info("Backup run completed in %.2fs - Success: %d, Failed: %d",
+                 duration, success_count, fail_count)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        close_connections()
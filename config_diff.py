@@ -5,21 +5,68 @@ Compares current config with previous backup
 """
 
 import os
+import sys
 import difflib
 from datetime import datetime
-import glob
+import heapq
 
-def find_latest_backup(device_name, backup_dir="backups"):
-    """Find the most recent backup for a device"""
-    pattern = f"{backup_dir}/*/{device_name}_*.txt"
-    backups = glob.glob(pattern)
+# Import zstandard if available (needed to read compressed backups)
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+BACKUP_SUFFIXES = ('.txt', '.txt.zst', '.ptr')
+
+def find_latest_backup(device_name, backup_dir="backups", count=2):
+    """Find the most recent backups for a device, newest first"""
+    try:
+        with os.scandir(backup_dir) as entries:
+            date_dirs = [entry.path for entry in entries
+                         if entry.is_dir() and not entry.name.startswith('.')]
+    except FileNotFoundError:
+        return None
     
-    if not backups:
+    # Date directories (YYYY-MM-DD) sort chronologically by name, so only walk
+    # back until enough candidate files have been found
+    prefix = f"{device_name}_"
+    candidates = []
+    for date_dir in sorted(date_dirs, reverse=True):
+        with os.scandir(date_dir) as entries:
+            candidates.extend(
+                entry for entry in entries
+                if entry.name.startswith(prefix) and entry.name.endswith(BACKUP_SUFFIXES)
+            )
+        if len(candidates) >= count:
+            break
+    
+    if not candidates:
         return None
     
-    # Sort by modification time, most recent first
-    backups.sort(key=os.path.getmtime, reverse=True)
-    return backups
+    latest = heapq.nlargest(count, candidates, key=lambda entry: entry.stat().st_mtime)
+    return [entry.path for entry in latest]
+
+def read_backup_lines(path):
+    """Read a backup's lines, following pointer files and decompressing .zst"""
+    if path.endswith('.ptr'):
+        pointer = path
+        with open(pointer, 'r') as f:
+            target = f.read().strip()
+        path = os.path.normpath(os.path.join(os.path.dirname(pointer), target))
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Pointer target missing: {pointer} refers to {path}, "
+                                    "which no longer exists (was its date folder pruned?)")
+    
+    if path.endswith('.zst'):
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        with open(path, 'rb') as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                return reader.read().decode().splitlines()
+    
+    with open(path, 'r') as f:
+        return f.read().splitlines()
 
 def compare_configs(device_name):
     """Compare the two most recent backups"""
@@ -41,12 +88,14 @@ def compare_configs(device_name):
     print(f"  Previous: {previous_backup}")
     print("="*80)
     
-    # Read both files
-    with open(current_backup, 'r') as f:
-        current_lines = f.readlines()
-    
-    with open(previous_backup, 'r') as f:
-        previous_lines = f.readlines()
+    # Read both files; difflib needs random access to the lines, so they are
+    # loaded as lists (without line endings, matching lineterm below)
+    try:
+        current_lines = read_backup_lines(current_backup)
+        previous_lines = read_backup_lines(previous_backup)
+    except (OSError, RuntimeError) as e:
+        print(f"✗ {e}")
+        return
     
     # Generate diff
     diff = difflib.unified_diff(
@@ -57,18 +106,20 @@ def compare_configs(device_name):
         lineterm=''
     )
     
-    # Display differences
+    # Display differences through one buffered writer instead of print per line
     changes_found = False
+    write = sys.stdout.write
     for line in diff:
         changes_found = True
         if line.startswith('+'):
-            print(f"\033[92m{line}\033[0m")  # Green for additions
+            write(f"\033[92m{line}\033[0m\n")  # Green for additions
         elif line.startswith('-'):
-            print(f"\033[91m{line}\033[0m")  # Red for removals
+            write(f"\033[91m{line}\033[0m\n")  # Red for removals
         elif line.startswith('@@'):
-            print(f"\033[94m{line}\033[0m")  # Blue for location markers
+            write(f"\033[94m{line}\033[0m\n")  # Blue for location markers
         else:
-            print(line)
+            write(line + "\n")
+    sys.stdout.flush()
     
     if not changes_found:
         print("\n✓ No differences found - configurations are identical!")
@@ -1,49 +1,78 @@
 #!/usr/bin/env python3
 """
 Email Notification Module
-Sends backup reports via email
+Sends backup reports via email, individually or batched into a digest
 """
 
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import atexit
+from email.message import EmailMessage
 from datetime import datetime
+import json
 import os
+from yaml_cache import load_yaml
 
-def send_email_report(success_count, fail_count, failed_devices=None, email_config=None):
-    """Send email report of backup results"""
-    
-    if email_config is None:
-        print("Email configuration not provided. Skipping email notification.")
-        return
-    
-    # Email configuration
-    sender_email = email_config.get('sender_email')
-    receiver_email = email_config.get('receiver_email')
-    smtp_server = email_config.get('smtp_server', 'smtp.gmail.com')
-    smtp_port = email_config.get('smtp_port', 587)
-    password = email_config.get('password')
-    
-    if not all([sender_email, receiver_email, password]):
-        print("Incomplete email configuration. Skipping notification.")
-        return
-    
-    # Create message
-    message = MIMEMultipart("alternative")
-    message["Subject"] = f"Network Backup Report - {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    message["From"] = sender_email
-    message["To"] = receiver_email
+PENDING_REPORTS_FILE = "pending_reports.jsonl"
+
+# Runs start on a fixed schedule but their start can drift slightly (e.g. a
+# previous run still finishing), so a digest is due this close to the interval
+DIGEST_SLACK_MINUTES = 10
+
+# SMTP session kept open between sends (e.g. successive scheduled runs)
+_smtp_conn = None
+_smtp_key = None
+
+def _get_smtp(smtp_server, smtp_port, sender_email, password):
+    """Return a logged-in SMTP session, reusing the previous one when possible"""
+    global _smtp_conn, _smtp_key
+    key = (smtp_server, smtp_port, sender_email)
     
-    # Email body
-    status = "✓ SUCCESS" if fail_count == 0 else "⚠ WARNING"
+    # Servers drop idle sessions well within the scheduler's interval; probe
+    # the cached one and start over if it no longer answers
+    if _smtp_conn is not None and _smtp_key == key:
+        try:
+            code, _ = _smtp_conn.noop()
+        except (smtplib.SMTPException, OSError):
+            code = None
+        if code != 250:
+            close_smtp()
     
-    html = f"""
-    <html>
-      <body style="font-family: Arial, sans-serif;">
-        <h2 style="color: {'green' if fail_count == 0 else 'orange'};">{status}</h2>
-        <h3>Network Configuration Backup Report</h3>
-        <p><strong>Date:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-        
+    if _smtp_conn is None or _smtp_key != key:
+        close_smtp()
+        server = smtplib.SMTP(smtp_server, smtp_port)
+        try:
+            server.starttls()
+            server.login(sender_email, password)
+        except Exception:
+            server.close()
+            raise
+        _smtp_conn, _smtp_key = server, key
+    return _smtp_conn
+
+def _is_stale_session(error):
+    """True if an SMTP error means the session was closed under us"""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421
+    # Socket-level failures (SMTPException is itself an OSError subclass)
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+def close_smtp():
+    """Close the cached SMTP session, if any"""
+    global _smtp_conn, _smtp_key
+    if _smtp_conn is not None:
+        try:
+            _smtp_conn.quit()
+        except (smtplib.SMTPException, OSError):
+            _smtp_conn.close()
+        _smtp_conn, _smtp_key = None, None
+
+atexit.register(close_smtp)
+
+def _report_table(success_count, fail_count, failed_devices):
+    """Render the results table (and failed device list) for one backup run"""
+    return f"""
         <table style="border-collapse: collapse; margin: 20px 0;">
           <tr style="background-color: #f2f2f2;">
             <td style="padding: 10px; border: 1px solid #ddd;"><strong>Successful Backups:</strong></td>
@@ -54,39 +83,175 @@ def send_email_report(success_count, fail_count, failed_devices=None, email_conf
             <td style="padding: 10px; border: 1px solid #ddd; color: red;">{fail_count}</td>
           </tr>
         </table>
-        
+
         {'<h4 style="color: red;">Failed Devices:</h4><ul>' + ''.join([f'<li>{dev}</li>' for dev in failed_devices]) + '</ul>' if failed_devices else ''}
-        
+    """
+
+def _render_html(fail_count, sections):
+    """Wrap rendered report sections in the common email layout"""
+    status = "✓ SUCCESS" if fail_count == 0 else "⚠ WARNING"
+
+    return f"""
+    <html>
+      <body style="font-family: Arial, sans-serif;">
+        <h2 style="color: {'green' if fail_count == 0 else 'orange'};">{status}</h2>
+        <h3>Network Configuration Backup Report</h3>
+        {sections}
         <p style="color: #666; font-size: 12px; margin-top: 30px;">
           This is an automated message from your Network Backup System.
         </p>
       </body>
     </html>
     """
-    
-    part = MIMEText(html, "html")
-    message.attach(part)
-    
+
+def email_config_complete(email_config):
+    """True if the configuration has everything needed to send mail"""
+    return isinstance(email_config, dict) and all(
+        email_config.get(key) for key in ('sender_email', 'receiver_email', 'password')
+    )
+
+def _send_html(subject, html, email_config):
+    """Send an HTML email using the given configuration"""
+    if email_config is None:
+        print("Email configuration not provided. Skipping email notification.")
+        return
+
+    if not email_config_complete(email_config):
+        print("Incomplete email configuration. Skipping notification.")
+        return
+
+    # Email configuration
+    sender_email = email_config.get('sender_email')
+    receiver_email = email_config.get('receiver_email')
+    smtp_server = email_config.get('smtp_server', 'smtp.gmail.com')
+    smtp_port = email_config.get('smtp_port', 587)
+    password = email_config.get('password')
+
+    # Create message
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = sender_email
+    message["To"] = receiver_email
+    message.set_content(html, subtype="html")
+
     # Send email
     try:
         print("\nSending email notification...")
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, password)
-            server.sendmail(sender_email, receiver_email, message.as_string())
+        try:
+            _get_smtp(smtp_server, smtp_port, sender_email, password).send_message(message)
+        except (smtplib.SMTPException, OSError) as e:
+            if not _is_stale_session(e):
+                raise
+            # The server dropped the session since the last send; reconnect once
+            close_smtp()
+            _get_smtp(smtp_server, smtp_port, sender_email, password).send_message(message)
         print("✓ Email notification sent successfully!")
         return True
     except Exception as e:
+        close_smtp()
         print(f"✗ Failed to send email: {e}")
         return False
 
+def send_email_report(success_count, fail_count, failed_devices=None, email_config=None):
+    """Send email report of backup results"""
+    now = datetime.now()
+    subject = f"Network Backup Report - {now.strftime('%Y-%m-%d %H:%M')}"
+
+    sections = f"""<p><strong>Date:</strong> {now.strftime('%Y-%m-%d %H:%M:%S')}</p>
+        {_report_table(success_count, fail_count, failed_devices)}"""
+
+    return _send_html(subject, _render_html(fail_count, sections), email_config)
+
+def queue_report(success_count, fail_count, failed_devices=None, pending_file=PENDING_REPORTS_FILE,
+                 started_at=None):
+    """Append a backup run's results (stamped with the run's start time) to the pending file"""
+    report = {
+        'timestamp': (started_at or datetime.now()).strftime('%Y-%m-%d %H:%M:%S'),
+        'success_count': success_count,
+        'fail_count': fail_count,
+        'failed_devices': list(failed_devices or []),
+    }
+    with open(pending_file, 'a') as f:
+        f.write(json.dumps(report) + "\n")
+
+def _load_pending(pending_file):
+    """Read queued reports, skipping any partially written lines"""
+    reports = []
+    try:
+        with open(pending_file, 'r') as f:
+            for line in f:
+                try:
+                    reports.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return reports
+
+def _claim_pending(pending_file):
+    """Move queued reports into the in-flight file and return its path"""
+    # Renaming first means runs that queue a report meanwhile start a fresh
+    # pending file, so removing the in-flight file after sending loses nothing
+    sending_file = f"{pending_file}.sending"
+    batch_file = f"{pending_file}.{os.getpid()}.tmp"
+    try:
+        os.replace(pending_file, batch_file)
+    except FileNotFoundError:
+        return sending_file
+
+    with open(batch_file, 'r') as src, open(sending_file, 'a') as dst:
+        dst.write(src.read())
+    os.remove(batch_file)
+    return sending_file
+
+def flush_reports(email_config, force=False, pending_file=PENDING_REPORTS_FILE, started_at=None):
+    """Send all queued reports as a single digest email once one is due"""
+    # Reports left in flight by a failed send come first, then newer ones
+    reports = _load_pending(f"{pending_file}.sending") + _load_pending(pending_file)
+    if not reports:
+        return None
+
+    # Age is measured between run start times, which sit on the schedule grid;
+    # end times vary with run duration and would push the digest a whole tick
+    now = datetime.now()
+    total_failed = sum(report['fail_count'] for report in reports)
+    oldest = datetime.strptime(reports[0]['timestamp'], '%Y-%m-%d %H:%M:%S')
+    age_hours = ((started_at or now) - oldest).total_seconds() / 3600
+
+    # Due when forced, when the oldest report has waited a full batch interval,
+    # or as soon as enough failures have accumulated
+    interval_hours = email_config.get('batch_interval_hours', 24)
+    failure_threshold = email_config.get('failure_threshold', 1)
+
+    due_hours = interval_hours - DIGEST_SLACK_MINUTES / 60
+    if not (force or age_hours >= due_hours or total_failed >= failure_threshold):
+        print(f"\nEmail report queued ({len(reports)} run(s) pending)")
+        return None
+
+    sending_file = _claim_pending(pending_file)
+    reports = _load_pending(sending_file)
+    total_failed = sum(report['fail_count'] for report in reports)
+
+    subject = f"Network Backup Report - {now.strftime('%Y-%m-%d %H:%M')}"
+    if len(reports) > 1:
+        subject += f" ({len(reports)} runs)"
+
+    sections = "".join(
+        f"""<p><strong>Date:</strong> {report['timestamp']}</p>
+        {_report_table(report['success_count'], report['fail_count'], report['failed_devices'])}"""
+        for report in reports
+    )
+
+    sent = _send_html(subject, _render_html(total_failed, sections), email_config)
+    if sent:
+        os.remove(sending_file)
+    return sent
+
 def load_email_config():
     """Load email configuration from file"""
     config_file = "email_config.yaml"
-    
+
     if not os.path.exists(config_file):
         return None
-    
-    import yaml
-    with open(config_file, 'r') as f:
-        return yaml.safe_load(f)
+
+    return load_yaml(config_file)
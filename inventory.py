@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Device Inventory
+Parses device_inventory.yaml once into immutable Device records shared by all tools
+"""
+
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from yaml_cache import load_yaml
+
+@dataclass(frozen=True)
+class Device:
+    """One inventory entry; extra netmiko options are kept as (key, value) pairs"""
+    host: str
+    device_type: str
+    username: str
+    password: Optional[str] = None
+    port: Optional[int] = None
+    device_name: Optional[str] = None
+    options: tuple = ()
+
+    @property
+    def name(self):
+        """Display name used for backup files, falling back to the host"""
+        return self.device_name or self.host
+
+    def connection_params(self):
+        """Keyword arguments for netmiko's ConnectHandler"""
+        params = {
+            'host': self.host,
+            'device_type': self.device_type,
+            'username': self.username,
+        }
+        # Leave the port to netmiko when unset; its default depends on the
+        # device type (e.g. 23 for *_telnet)
+        if self.port is not None:
+            params['port'] = self.port
+        if self.password is not None:
+            params['password'] = self.password
+        params.update(self.options)
+        return params
+
+    @classmethod
+    def from_dict(cls, entry):
+        """Build a Device from one inventory mapping"""
+        if not isinstance(entry, dict):
+            raise ValueError(f"Device entry {entry!r} is not a mapping")
+        entry = dict(entry)
+        missing = [key for key in ('host', 'device_type', 'username') if not entry.get(key)]
+        if missing:
+            raise ValueError(f"Device entry {entry.get('device_name', entry.get('host', '?'))} "
+                             f"is missing: {', '.join(missing)}")
+
+        return cls(
+            host=entry.pop('host'),
+            device_type=entry.pop('device_type'),
+            username=entry.pop('username'),
+            password=entry.pop('password', None),
+            port=entry.pop('port', None),
+            device_name=entry.pop('device_name', None),
+            options=tuple(sorted(entry.items()))
+        )
+
+def _entry_name(entry, position):
+    """Best available name for an inventory entry, for error reporting"""
+    if isinstance(entry, dict):
+        name = entry.get('device_name') or entry.get('host')
+        if name:
+            return name
+    return f"entry #{position}"
+
+@lru_cache(maxsize=8)
+def _parse_inventory(inventory_file, mtime_ns):
+    """Parse an inventory file; cached per file version"""
+    data = load_yaml(inventory_file)
+
+    # An invalid entry is reported on its own rather than failing the whole file
+    devices = []
+    invalid = []
+    for position, entry in enumerate(data['devices'], start=1):
+        try:
+            devices.append(Device.from_dict(entry))
+        except (TypeError, ValueError) as e:
+            invalid.append((_entry_name(entry, position), str(e)))
+    return tuple(devices), tuple(invalid)
+
+def load_inventory(inventory_file):
+    """Return (devices, invalid) for an inventory, re-parsing only when the file changes"""
+    # invalid holds (name, error) pairs for entries that could not be parsed
+    return _parse_inventory(inventory_file, os.stat(inventory_file).st_mtime_ns)
@@ -4,26 +4,19 @@ Backup Scheduler
 Schedule automated backups at specific intervals
 """
 
-import schedule
-import time
-import subprocess
+from apscheduler.schedulers.blocking import BlockingScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
 from datetime import datetime
+import backup_script
 
-def run_backup():
-    """Execute the backup script"""
+def run_backup(args):
+    """Run a backup in-process so SSH sessions persist between runs"""
     print(f"\n{'='*60}")
     print(f"Scheduled Backup Started: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*60}")
     
     try:
-        result = subprocess.run(
-            ['python3', 'backup_script.py'],
-            capture_output=True,
-            text=True
-        )
-        print(result.stdout)
-        if result.returncode != 0:
-            print(f"Error: {result.stderr}")
+        backup_script.main(args)
     except Exception as e:
         print(f"Failed to run backup: {e}")
 
@@ -38,23 +31,34 @@ def main():
     print("\nPress Ctrl+C to stop the scheduler")
     print("="*60)
     
+    # Backup options are parsed once and reused by every run
+    args = backup_script.parse_args([])
+    
+    # The scheduler sleeps until the next due job instead of polling. A single
+    # worker keeps runs sequential, and a run that comes due while another is
+    # still going waits for it rather than being dropped.
+    scheduler = BlockingScheduler(
+        executors={'default': ThreadPoolExecutor(max_workers=1)},
+        job_defaults={'coalesce': True, 'misfire_grace_time': None}
+    )
+    
     # Schedule daily backup at 2 AM
-    schedule.every().day.at("02:00").do(run_backup)
+    scheduler.add_job(run_backup, 'cron', hour=2, minute=0, args=[args])
     
     # Schedule backup every 6 hours
-    schedule.every(6).hours.do(run_backup)
+    scheduler.add_job(run_backup, 'interval', hours=6, args=[args])
     
     # Run once immediately for testing
     print("\nRunning initial backup...")
-    run_backup()
+    run_backup(args)
     
     # Keep the scheduler running
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Check every minute
+    scheduler.start()
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
         print("\n\nScheduler stopped by user")
+    finally:
+        backup_script.close_connections()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+YAML Loader with JSON Cache
+Keeps a parsed JSON copy next to each YAML file so repeat runs skip YAML parsing
+"""
+
+import json
+import os
+import yaml
+
+# Prefer the libyaml C parser; fall back to the pure-Python one
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+def cache_path(yaml_file):
+    """Return the sidecar cache path for a YAML file"""
+    directory, name = os.path.split(yaml_file)
+    return os.path.join(directory, f".{name}.cache.json")
+
+def _read_cache(cache_file, stat):
+    """Return cached data if it was built from the current YAML file, else None"""
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get('mtime_ns') != stat.st_mtime_ns or cached.get('size') != stat.st_size:
+        return None
+    return cached.get('data')
+
+def _write_cache(cache_file, stat, data):
+    """Write the cache atomically; it may hold credentials, so keep it owner-only"""
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'data': data}, f)
+        os.replace(tmp_file, cache_file)
+    except (OSError, TypeError, ValueError):
+        # Not JSON-serializable or not writable - just run without a cache
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def load_yaml(yaml_file):
+    """Load a YAML file, reusing the JSON cache while the YAML is unchanged"""
+    stat = os.stat(yaml_file)
+    cache_file = cache_path(yaml_file)
+
+    data = _read_cache(cache_file, stat)
+    if data is not None:
+        return data
+
+    with open(yaml_file, 'r') as f:
+        data = yaml.load(f, Loader=_Loader)
+
+    _write_cache(cache_file, stat, data)
+    return data